@@ -1,13 +1,20 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
 class RequestLoggingMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        print(f"\nRequest: {request.method} {request.path}")
-        print(f"Body: {request.body}")
+        if not logger.isEnabledFor(logging.DEBUG):
+            return self.get_response(request)
+
+        logger.debug("Request: %s %s", request.method, request.path)
+        logger.debug("Body: %s", request.body)
         
         response = self.get_response(request)
         
-        print(f"Response Status: {response.status_code}")
-        print(f"Response Content: {response.content}\n")
+        logger.debug("Response Status: %s", response.status_code)
+        logger.debug("Response Content: %s", response.content)
         return response
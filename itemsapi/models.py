@@ -18,9 +18,11 @@ class Item(MPTTModel):
     def validate_move(self, new_parent):
         """Validates move operation before execution"""
         if new_parent:
-            if self.is_ancestor_of(new_parent):
+            # Plain comparison on the already-loaded MPTT columns
+            if (self.tree_id == new_parent.tree_id and
+                    self.lft < new_parent.lft and self.rght > new_parent.rght):
                 raise ValidationError("Cannot move item under its own descendant")
-            if new_parent == self:
+            if new_parent.pk == self.pk:
                 raise ValidationError("Cannot move item under itself")
         return True
 
@@ -31,11 +33,20 @@ class Item(MPTTModel):
             old_parent = self.parent
             self._previous_parent = old_parent
             self.parent = new_parent
-            self.save()
+            # MPTT rewrites the tree columns while moving; only parent is left to persist
+            self.save(update_fields=['parent'])
             return self
         except ValidationError as e:
             raise e  # Re-raise to be caught by view layer
 
+    def delete_subtree(self):
+        """Deletes this item and its descendants by lft/rght range, then closes
+        the gap in the tree. Call inside a transaction on a freshly read row."""
+        self.get_descendants(include_self=True).delete()
+        # _close_gap is private mptt API (one UPDATE, where partial_rebuild
+        # rewrites every row of the tree); requirements.txt pins the tested series
+        self._tree_manager._close_gap(self.rght - self.lft + 1, self.rght, self.tree_id)
+
     def get_inventory_tree(self):
         """Returns complete inventory structure"""
         return {
@@ -67,6 +78,10 @@ class Item(MPTTModel):
             'emails': Email.objects.filter(item_id__in=item_ids),
             'codes': CodeIdentifier.objects.filter(item_id__in=item_ids)
         }
+
+# Resolved once at import; used by every endpoint that prefetches item relations
+PREFETCH_FIELDS = tuple(Item.get_prefetch_fields())
+
 class CodeIdentifier(models.Model):
     item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='codes')
     code = models.CharField(max_length=100, db_index=True)
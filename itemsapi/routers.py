@@ -1,72 +1,295 @@
-from ninja import Router
+from collections import defaultdict
+import logging
+import orjson
+from ninja import Query, Router
 from ninja.errors import HttpError
-from django.shortcuts import get_object_or_404
-from django.db.models import Q
+from ninja.responses import NinjaJSONEncoder
+from django.http import HttpResponse
+from django.db.models import Q, prefetch_related_objects
 from mptt.exceptions import InvalidMove
 from typing import List, Optional
 from django.core.exceptions import ValidationError
-from .models import ComponentHistory, Item
-from .schemas import ComponentHistorySchema, ItemCreate, ItemOut, MovePayload
+from .models import PREFETCH_FIELDS, CodeIdentifier, ComponentHistory, Email, File, Item, Note
+from .schemas import (
+    CodeIdentifierSchema, ComponentHistorySchema, EmailSchema, FileSchema, ItemCreate,
+    ItemFlatOut, ItemOut, MovePayload, NoteSchema,
+)
 from django.db import transaction
 
+logger = logging.getLogger(__name__)
+
+_ninja_encoder = NinjaJSONEncoder()
+
+# Children always come from _attach_children buckets (or are empty for flat
+# views), so prefetching 'children' would only load the same rows again
+BUCKETED_PREFETCH_FIELDS = tuple(f for f in PREFETCH_FIELDS if f != 'children')
+
+# Most subtree ranges OR'd into a single search query
+SEARCH_MAX_RANGE_TERMS = 50
+
 router = Router()
+
+def _get_item_or_404(item_id, message="Item not found", queryset=None):
+    """Fetch an item by pk or raise a 404, without exception-driven lookups"""
+    item = (Item.objects if queryset is None else queryset).filter(pk=item_id).first()
+    if item is None:
+        raise HttpError(404, message)
+    return item
+
+def _precompute(it, full_path):
+    """Store the full_path and attachment_count values read by ItemOut's resolvers"""
+    it._full_path = full_path
+    it._attachment_count = (len(it.notes.all()) + len(it.files.all()) +
+                            len(it.emails.all()) + len(it.codes.all()))
+
+def _attach_children(items, paths=None):
+    """Bucket items by parent_id and precompute what ItemOut's children,
+    full_path and attachment_count resolvers read.
+
+    Items must be in tree order (tree_id, lft) with relations prefetched.
+    ``paths`` seeds full paths of parents outside ``items`` by id; an item whose
+    parent is neither in ``items`` nor seeded costs one ancestors query.
+    """
+    buckets = defaultdict(list)
+    paths = dict(paths or {})
+    for it in items:
+        buckets[it.parent_id].append(it)
+        parent_path = paths.get(it.parent_id)
+        if parent_path is not None:
+            full_path = f"{parent_path}/{it.name}"
+        elif it.parent_id is None:
+            full_path = it.name
+        else:
+            full_path = it.get_full_path()
+        paths[it.id] = full_path
+        _precompute(it, full_path)
+    for it in items:
+        it._children_override = buckets.get(it.id, [])
+    return buckets
+
+def _outermost_matches(matches):
+    """Sort (pk, tree_id, lft, rght, parent_id) matches into tree order,
+    dropping matches nested inside another match's subtree"""
+    outermost = []
+    for match in sorted(matches, key=lambda m: (m[1], m[2])):
+        _, tree_id, lft, rght, _ = match
+        # MPTT ranges never partially overlap, so a range starting inside the
+        # previous one in the same tree is contained by it
+        if not outermost or tree_id != outermost[-1][1] or lft > outermost[-1][3]:
+            outermost.append(match)
+    return outermost
+
+def _tree_ranges_q(matches, range_q):
+    """OR range_q(lft, rght) for each match, under one tree_id condition per tree"""
+    ranges_by_tree = defaultdict(Q)
+    for _, tree_id, lft, rght, _ in matches:
+        ranges_by_tree[tree_id] |= range_q(lft, rght)
+    q = Q()
+    for tree_id, tree_ranges in ranges_by_tree.items():
+        q |= Q(tree_id=tree_id) & tree_ranges
+    return q
+
+def _prepared_subtree(item):
+    """Reload item with its subtree prefetched and bucketed for ItemOut"""
+    subtree = list(item.get_descendants(include_self=True).prefetch_related(*BUCKETED_PREFETCH_FIELDS))
+    _attach_children(subtree)
+    return subtree[0]
+
+def _json_response(data):
+    """Encode plain data with orjson, bypassing ninja schema validation.
+
+    Datetimes and other non-native values go through ninja's own encoder so the
+    output matches the schema-validated endpoints.
+    """
+    return HttpResponse(
+        orjson.dumps(data, default=_ninja_encoder.default, option=orjson.OPT_PASSTHROUGH_DATETIME),
+        content_type='application/json'
+    )
+
+def _file_url(file):
+    return file.url if file else None
+
+def _schema_row(schema, obj, **values):
+    """Dict with the schema's fields in declaration order, read from obj unless given"""
+    return {name: values[name] if name in values else getattr(obj, name) for name in schema.model_fields}
+
+def _serialize_tree(buckets, parent_id):
+    """Build ItemOut-shaped dicts for the children of parent_id from _attach_children buckets"""
+    return [_schema_row(
+        ItemOut, it,
+        children=_serialize_tree(buckets, it.id),
+        history=[_schema_row(ComponentHistorySchema, h) for h in it.history.all()],
+        notes=[_schema_row(NoteSchema, n) for n in it.notes.all()],
+        codes=[_schema_row(CodeIdentifierSchema, c) for c in it.codes.all()],
+        files=[_schema_row(FileSchema, f, file=_file_url(f.file)) for f in it.files.all()],
+        emails=[_schema_row(EmailSchema, e) for e in it.emails.all()],
+        full_path=it._full_path,
+        attachment_count=it._attachment_count,
+    ) for it in buckets.get(parent_id, [])]
+
+def _group_by_item(queryset, *fields):
+    """Group related rows as plain dicts keyed by item_id"""
+    grouped = defaultdict(list)
+    for row in queryset.values('item_id', 'id', 'created_at', *fields):
+        grouped[row.pop('item_id')].append(row)
+    return grouped
+
+def _flat_items_response():
+    """ItemFlatOut-shaped item list with attachments, children linked client-side via parent_id"""
+    notes = _group_by_item(Note.objects.all(), 'content')
+    codes = _group_by_item(CodeIdentifier.objects.all(), 'code', 'source')
+    files = _group_by_item(File.objects.all(), 'file', 'file_type')
+    emails = _group_by_item(Email.objects.all(), 'subject', 'body', 'from_address', 'received_at')
+    storage = File._meta.get_field('file').storage
+    for rows in files.values():
+        for row in rows:
+            row['file'] = storage.url(row['file']) if row['file'] else None
+
+    items = list(Item.objects.order_by('tree_id', 'lft').values(
+        'id', 'name', 'description', 'qr_code', 'parent_id', 'level', 'tree_id', 'created_at'
+    ))
+    for row in items:
+        row['notes'] = notes.get(row['id'], [])
+        row['codes'] = codes.get(row['id'], [])
+        row['files'] = files.get(row['id'], [])
+        row['emails'] = emails.get(row['id'], [])
+    return _json_response(items)
+
 @router.get("/items", response=List[ItemOut])
 def list_items(request):
-    """Get full inventory tree starting from root items (computers, storage, etc)"""
-    return Item.objects.root_nodes().prefetch_related(*Item.get_prefetch_fields())
+    """Get full inventory tree starting from root items (computers, storage, etc)
+
+    The nested response is serialized directly with orjson rather than
+    validated through ItemOut.
+    """
+    # Every item belongs to some root's tree, so one ordered fetch covers all
+    # trees and each relation is prefetched once regardless of tree count
+    items = list(Item.objects.order_by('tree_id', 'lft'))
+    prefetch_related_objects(items, *BUCKETED_PREFETCH_FIELDS)
+    return _json_response(_serialize_tree(_attach_children(items), None))
+
+# Registered before /items/{item_id} so "flat" is not parsed as an id
+@router.get("/items/flat", response=List[ItemFlatOut])
+def list_items_flat(request):
+    """Get every item once, without nesting; clients rebuild the tree from parent_id
+
+    Serialized directly with orjson rather than validated through ItemFlatOut.
+    """
+    return _flat_items_response()
+
+# Registered before /items/{item_id} so "search" is not parsed as an id
+@router.get("/items/search", response=List[ItemOut])
+def search_items(request, q: str):
+    """Search components by name, description or QR code"""
+    match_q = Q(name__icontains=q) | Q(description__icontains=q) | Q(qr_code__iexact=q)
+    # Only the tree columns are needed to derive the subtree ranges and paths
+    matches = list(Item.objects.filter(match_q).values_list('pk', 'tree_id', 'lft', 'rght', 'parent_id'))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Search %r matched %d items: %s", q, len(matches), [pk for pk, *_ in matches])
+    if not matches:
+        return []
+    outermost = _outermost_matches(matches)
+    # At most SEARCH_MAX_RANGE_TERMS ranges per query keeps each WHERE clause
+    # well under SQLite's expression depth limit (1000). On SQLite each query
+    # is one tree_id index search per tree (the table has no (tree_id, lft)
+    # index, so the ranges are checked per row). Batches are disjoint and in
+    # tree order, so the concatenated rows stay in (tree_id, lft) order.
+    subtree = []
+    for i in range(0, len(outermost), SEARCH_MAX_RANGE_TERMS):
+        subtree_q = _tree_ranges_q(outermost[i:i + SEARCH_MAX_RANGE_TERMS],
+                                   lambda lft, rght: Q(lft__gte=lft, rght__lte=rght))
+        subtree += Item.objects.filter(subtree_q).order_by('tree_id', 'lft')
+    prefetch_related_objects(subtree, *BUCKETED_PREFETCH_FIELDS)
+    # The outermost matches' parents are outside the fetched subtrees, so
+    # their full paths are seeded from the ancestors' names. Siblings share
+    # ancestors, so one range per distinct parent finds all of them.
+    seeds = list({m[4]: m for m in outermost if m[4] is not None}.values())
+    paths = {}
+    for i in range(0, len(seeds), SEARCH_MAX_RANGE_TERMS):
+        ancestors_q = _tree_ranges_q(seeds[i:i + SEARCH_MAX_RANGE_TERMS],
+                                     lambda lft, rght: Q(lft__lt=lft, rght__gt=rght))
+        # Tree order puts each parent before its children
+        for pk, parent_id, name in (Item.objects.filter(ancestors_q)
+                                    .order_by('tree_id', 'lft')
+                                    .values_list('pk', 'parent_id', 'name')):
+            paths[pk] = name if parent_id is None else f"{paths[parent_id]}/{name}"
+    _attach_children(subtree, paths)
+    match_ids = {pk for pk, *_ in matches}
+    return [it for it in subtree if it.id in match_ids]
 
 @router.get("/items/{item_id}", response=ItemOut)
 def get_item(request, item_id: int):
     """Get item with its complete subtree (e.g., GPU with waterblock)"""
-    return get_object_or_404(Item.objects.prefetch_related(*Item.get_prefetch_fields()), id=item_id)
+    return _prepared_subtree(_get_item_or_404(item_id))
 
 @router.get("/items/{item_id}/path", response=List[ItemOut])
 def get_component_path(request, item_id: int):
     """Get full path to component (e.g., Shop->Laptop->Motherboard->CPU)"""
-    item = get_object_or_404(Item, id=item_id)
-    return item.get_ancestors(include_self=True)
+    item = _get_item_or_404(item_id)
+    path = list(item.get_ancestors(include_self=True).prefetch_related(*BUCKETED_PREFETCH_FIELDS))
+    # Ancestors come root first, so each full_path extends the previous one;
+    # the path is a flat list, so no children are nested under its entries
+    full_path = None
+    for ancestor in path:
+        full_path = ancestor.name if full_path is None else f"{full_path}/{ancestor.name}"
+        _precompute(ancestor, full_path)
+        ancestor._children_override = []
+    return path
 
 @router.get("/items/{item_id}/siblings", response=List[ItemOut])
 def get_similar_components(request, item_id: int):
     """Get components at same level - useful for finding compatible parts"""
-    item = get_object_or_404(Item, id=item_id)
-    return item.get_siblings(include_self=False)
-
-@router.get("/items/search", response=List[ItemOut])
-def search_items(request, q: str):
-    """Search components by name, description or QR code"""
-    return Item.objects.filter(
-        Q(name__icontains=q) |
-        Q(description__icontains=q) |
-        Q(qr_code__iexact=q)
-    ).prefetch_related(*Item.get_prefetch_fields())
+    item = _get_item_or_404(item_id)
+    # Load the siblings' subtrees in one query: everything under the parent
+    # (or every other tree, for roots) except this item's own subtree
+    if item.parent_id is None:
+        subtrees = Item.objects.exclude(tree_id=item.tree_id)
+        paths = {}
+    else:
+        parent = item.parent
+        subtrees = parent.get_descendants().exclude(
+            tree_id=item.tree_id, lft__gte=item.lft, rght__lte=item.rght
+        )
+        paths = {parent.id: parent.get_full_path()}
+    buckets = _attach_children(list(subtrees.prefetch_related(*BUCKETED_PREFETCH_FIELDS)), paths)
+    return buckets[item.parent_id]
 
 @router.post("/items", response={201: ItemOut})
 def create_item(request, payload: ItemCreate):
     with transaction.atomic():
-        parent = get_object_or_404(Item, id=payload.parent_id) if payload.parent_id else None
+        # Passing the loaded parent lets MPTT reuse it when placing the node
+        parent = _get_item_or_404(payload.parent_id, "Parent item not found") if payload.parent_id else None
         item = Item.objects.create(
             name=payload.name,
             description=payload.description,
             qr_code=payload.qr_code,
             parent=parent
         )
-        return 201, item
+    return 201, _prepared_subtree(item)
     
 @router.get("/items/{item_id}/history", response=List[ComponentHistorySchema])
-def get_item_history(request, item_id: int):
-    """Get complete movement history for a component"""
-    item = get_object_or_404(Item, id=item_id)
-    return item.history.all()
+def get_item_history(request, item_id: int, limit: int = Query(100, ge=1, le=1000),
+                     offset: int = Query(0, ge=0)):
+    """Get movement history for a component (newest first), one page at a time"""
+    if not Item.objects.filter(id=item_id).exists():
+        raise HttpError(404, "Item not found")
+    history = ComponentHistory.objects.filter(item_id=item_id).order_by('-changed_at', '-id')
+    return history[offset:offset + limit]
 
 @router.put("/items/{item_id}/move", response=ItemOut)
 def move_item(request, item_id: int, payload: MovePayload):
     with transaction.atomic():
-        item = get_object_or_404(Item, id=item_id)
-        new_parent = get_object_or_404(Item, id=payload.new_parent_id) if payload.new_parent_id else None
+        item = _get_item_or_404(item_id)
+        if payload.new_parent_id == item_id:
+            # Self-move: reuse the loaded row and let validate_move reject it
+            new_parent = item
+        elif payload.new_parent_id:
+            new_parent = _get_item_or_404(payload.new_parent_id, "Parent item not found")
+        else:
+            new_parent = None
         try:
             moved_item = item.move_under(new_parent)
-            return moved_item
+            return _prepared_subtree(moved_item)
         except ValidationError as e:
             raise HttpError(400, str(e))
 
@@ -74,6 +297,9 @@ def move_item(request, item_id: int, payload: MovePayload):
 @router.delete("/items/{item_id}", response={204: None})
 def delete_item(request, item_id: int):
     """Delete component and all its subcomponents"""
-    item = get_object_or_404(Item, id=item_id)
-    item.delete()
+    with transaction.atomic():
+        # Read the tree fields under the row lock so the range delete matches
+        # the item's current position, not one from before a concurrent move
+        item = _get_item_or_404(item_id, queryset=Item.objects.select_for_update())
+        item.delete_subtree()
     return 204, None
@@ -1,10 +1,13 @@
 from ninja import Schema
 from typing import List, Optional
 from datetime import datetime
-from pydantic import field_validator
+from pydantic import ConfigDict, field_validator
 
 # Base schemas for attachments
 class AttachmentBase(Schema):
+    # Output-only schemas are immutable once built from the ORM objects
+    model_config = ConfigDict(frozen=True)
+
     id: int
     created_at: datetime
 
@@ -13,6 +16,8 @@ class CodeIdentifierSchema(AttachmentBase):
     source: str
     
 class ComponentHistorySchema(Schema):
+    model_config = ConfigDict(frozen=True)
+
     id: int
     old_parent_id: Optional[int]
     new_parent_id: Optional[int]
@@ -41,7 +46,7 @@ class ItemBase(Schema):
     # Remove level from base schema since it's computed
     @staticmethod
     def resolve_level(obj):
-        return obj.get_level()
+        return obj.level
     
 class MovePayload(Schema):
     new_parent_id: Optional[int] = None
@@ -59,7 +64,22 @@ class ItemCreate(Schema):
     qr_code: Optional[str] = None
     parent_id: Optional[int] = None
 
+class ItemFlatOut(ItemBase):
+    model_config = ConfigDict(frozen=True)
+
+    id: int
+    parent_id: Optional[int]
+    level: int
+    tree_id: int
+    created_at: datetime
+    notes: List[NoteSchema] = []
+    codes: List[CodeIdentifierSchema] = []
+    files: List[FileSchema] = []
+    emails: List[EmailSchema] = []
+
 class ItemOut(ItemBase):
+    model_config = ConfigDict(frozen=True)
+
     id: int
     parent_id: Optional[int]
     created_at: datetime
@@ -73,15 +93,17 @@ class ItemOut(ItemBase):
     full_path: str
     attachment_count: int
     
+    # The routers precompute these on every item they return (see
+    # _attach_children); resolvers receive ninja's DjangoGetter, so plain
+    # attribute access is used rather than getattr defaults
     @staticmethod
     def resolve_children(obj):
-        return obj.get_children().prefetch_related(*obj.get_prefetch_fields())
+        return obj._children_override
     
     @staticmethod
     def resolve_full_path(obj):
-        return obj.get_full_path()
+        return obj._full_path
     
     @staticmethod
     def resolve_attachment_count(obj):
-        return (obj.notes.count() + obj.files.count() + 
-                obj.emails.count() + obj.codes.count())
+        return obj._attachment_count
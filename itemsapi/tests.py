@@ -1,3 +1,5 @@
+from math import ceil
+
 from django.test import TestCase
 from django.core.management import call_command
 from django.utils import timezone
@@ -6,6 +8,8 @@ from ninja.testing import TestClient
 
 from .models import Item, Note, Email, File, CodeIdentifier, ComponentHistory
 from .api import api
+from .routers import BUCKETED_PREFETCH_FIELDS, SEARCH_MAX_RANGE_TERMS
+from .schemas import ItemFlatOut, ItemOut
 
 class InventorySystemTests(TestCase):
     """
@@ -78,7 +82,8 @@ class InventorySystemTests(TestCase):
         
         response = self.client.put(
             f"/api/items/{thermal_paste.id}/move",
-            json={"new_parent_id": laptop.id}
+            {"new_parent_id": laptop.id},
+            content_type="application/json"
         )
         self.assertEqual(response.status_code, 200)
         
@@ -110,7 +115,8 @@ class InventorySystemTests(TestCase):
        
         response = self.client.post(
             "/api/items",
-            json=payload
+            payload,
+            content_type="application/json"
         )
         if response.status_code != 201:
             print(f"Error creating item: {response.content}")
@@ -120,7 +126,8 @@ class InventorySystemTests(TestCase):
         # Test movement
         response = self.client.put(
             f"/api/items/{ram_id}/move",
-            json={"new_parent_id": self.storage.id}
+            {"new_parent_id": self.storage.id},
+            content_type="application/json"
         )
         self.assertEqual(response.status_code, 200)
         
@@ -128,31 +135,85 @@ class InventorySystemTests(TestCase):
         history = self.client.get(f"/api/items/{ram_id}/history")
         self.assertGreaterEqual(len(history.json()), 1)
 
+        # Missing parent is reported without creating anything
+        response = self.client.post(
+            "/api/items",
+            {"name": "Orphan", "parent_id": 999999},
+            content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['detail'], "Parent item not found")
+        self.assertFalse(Item.objects.filter(name="Orphan").exists())
+
     def test_search_functionality(self):
         """Test search capabilities across different fields"""
         # Create test items
-        Item.objects.create(
+        ddr4 = Item.objects.create(
             name="DDR4 RAM",
             description="8GB 2400MHz",
             qr_code="RAM001"
         )
-        Item.objects.create(
+        ddr3 = Item.objects.create(
             name="DDR3 RAM",
             description="4GB 1600MHz",
             qr_code="RAM002"
         )
+        heatsink = Item.objects.create(name="Heatsink", parent=ddr4)
         
-        # Test name search
-        response = self.client.get("/api/items/search", params={"q": "DDR4"})
-        self.assertEqual(len(response.json()), 1)
+        # Test name search: the match query, one range query and the prefetches
+        with self.assertNumQueries(2 + len(BUCKETED_PREFETCH_FIELDS)):
+            response = self.client.get("/api/items/search?q=DDR4")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([row['id'] for row in data], [ddr4.id])
+        self.assertEqual([row['id'] for row in data[0]['children']], [heatsink.id])
         
         # Test description search
-        response = self.client.get("/api/items/search", params={"q": "1600MHz"})
-        self.assertEqual(len(response.json()), 1)
+        response = self.client.get("/api/items/search?q=1600MHz")
+        self.assertEqual([row['id'] for row in response.json()], [ddr3.id])
         
         # Test QR code search
-        response = self.client.get("/api/items/search", params={"q": "RAM001"})
-        self.assertEqual(len(response.json()), 1)
+        response = self.client.get("/api/items/search?q=RAM001")
+        self.assertEqual([row['id'] for row in response.json()], [ddr4.id])
+
+        # Paths of non-root matches come from one extra ancestors query
+        thermal_pad = Item.objects.create(name="Thermal pad", parent=ddr4)
+        with self.assertNumQueries(3 + len(BUCKETED_PREFETCH_FIELDS)):
+            response = self.client.get("/api/items/search?q=thermal")
+        data = response.json()
+        self.assertEqual([row['id'] for row in data], [thermal_pad.id])
+        self.assertEqual(data[0]['full_path'], "DDR4 RAM/Thermal pad")
+
+        # Nested matches are each returned once
+        response = self.client.get("/api/items/search?q=a")
+        ids = [row['id'] for row in response.json()]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertIn(heatsink.id, ids)
+
+    def test_search_many_matches(self):
+        """Test search query count grows per batch of ranges, not per match"""
+        with Item.objects.disable_mptt_updates():
+            Item.objects.bulk_create(
+                [Item(name=f"Spare fan {i}", parent=self.storage, lft=0, rght=0, level=0, tree_id=0)
+                 for i in range(1200)] +
+                [Item(name=f"Loose fan {i}", lft=0, rght=0, level=0, tree_id=0)
+                 for i in range(1500)]
+            )
+        Item.objects.rebuild()
+
+        # The match query, one range query per batch, the prefetches and one
+        # ancestors query for the shared parent
+        with self.assertNumQueries(ceil(1200 / SEARCH_MAX_RANGE_TERMS) + 2 + len(BUCKETED_PREFETCH_FIELDS)):
+            response = self.client.get("/api/items/search?q=spare%20fan")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data), 1200)
+        self.assertEqual(data[0]['full_path'], f"Storage Room/{data[0]['name']}")
+
+        with self.assertNumQueries(ceil(2700 / SEARCH_MAX_RANGE_TERMS) + 2 + len(BUCKETED_PREFETCH_FIELDS)):
+            response = self.client.get("/api/items/search?q=fan")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2700)
 
     def test_attachment_management(self):
         """Test all types of attachments and documentation"""
@@ -211,6 +272,101 @@ class InventorySystemTests(TestCase):
         self.assertEqual(computer.level, 0)
         self.assertEqual(cpu.level, 1)
 
+    def test_component_path_and_siblings(self):
+        """Test path and sibling endpoints serialize precomputed item fields"""
+        board = Item.objects.create(name="Motherboard", parent=self.laptop)
+        cpu = Item.objects.create(name="CPU", parent=board)
+        ram = Item.objects.create(name="RAM", parent=board)
+        Note.objects.create(item=cpu, content="Repasted")
+
+        response = self.client.get(f"/api/items/{cpu.id}/path")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([row['id'] for row in data],
+                         [self.workbench.id, self.laptop.id, board.id, cpu.id])
+        self.assertEqual(data[-1]['full_path'], "Workbench A/Customer Laptop/Motherboard/CPU")
+        self.assertEqual(data[-1]['attachment_count'], 1)
+        self.assertTrue(all(row['children'] == [] for row in data))
+
+        response = self.client.get(f"/api/items/{cpu.id}/siblings")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([row['id'] for row in data], [ram.id])
+        self.assertEqual(data[0]['full_path'], "Workbench A/Customer Laptop/Motherboard/RAM")
+
+    def test_flat_item_list(self):
+        """Test flat listing returns every item once with grouped attachments"""
+        gpu = Item.objects.create(name="GPU", parent=self.laptop)
+        Note.objects.create(item=gpu, content="Fan noise")
+
+        response = self.client.get("/api/items/flat")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data), Item.objects.count())
+
+        gpu_data = next(row for row in data if row['id'] == gpu.id)
+        self.assertEqual(set(gpu_data), set(ItemFlatOut.model_fields))
+        self.assertEqual(gpu_data['parent_id'], self.laptop.id)
+        self.assertEqual(gpu_data['level'], 2)
+        self.assertEqual(len(gpu_data['notes']), 1)
+        self.assertEqual(gpu_data['notes'][0]['content'], "Fan noise")
+
+    def test_item_list_matches_item_schema(self):
+        """Test /items tree nodes match the ItemOut output of the detail endpoint"""
+        gpu = Item.objects.create(name="GPU", parent=self.laptop)
+        Note.objects.create(item=gpu, content="Fan noise")
+        Email.objects.create(item=gpu, subject="RMA", body="Approved",
+                             from_address="support@vendor.com", received_at=timezone.now())
+        File.objects.create(item=gpu, file="test.pdf", file_type="application/pdf")
+        CodeIdentifier.objects.create(item=gpu, code="GPU123", source="manufacturer")
+
+        response = self.client.get("/api/items")
+        self.assertEqual(response.status_code, 200)
+        node = next(row for row in response.json() if row['id'] == self.workbench.id)
+        self.assertEqual(list(node), list(ItemOut.model_fields))
+
+        response = self.client.get(f"/api/items/{self.workbench.id}")
+        self.assertEqual(node, response.json())
+
+    def test_history_limit(self):
+        """Test history endpoint returns newest entries first, bounded by limit"""
+        ssd = Item.objects.create(name="SSD", parent=self.storage)
+        ssd.move_under(self.laptop)
+        ssd.move_under(self.storage)
+
+        response = self.client.get(f"/api/items/{ssd.id}/history")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 3)
+
+        response = self.client.get(f"/api/items/{ssd.id}/history?limit=1")
+        data = response.json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['new_parent_id'], self.storage.id)
+
+        response = self.client.get(f"/api/items/{ssd.id}/history?limit=2&offset=2")
+        data = response.json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['action_type'], ComponentHistory.CREATED)
+
+        response = self.client.get("/api/items/999999/history")
+        self.assertEqual(response.status_code, 404)
+
+    def test_delete_subtree(self):
+        """Test deleting a component removes its subtree and keeps the tree consistent"""
+        desktop = Item.objects.create(name="Desktop", parent=self.workbench)
+        psu = Item.objects.create(name="PSU", parent=desktop)
+        Note.objects.create(item=psu, content="Capacitors bulging")
+
+        response = self.client.delete(f"/api/items/{desktop.id}")
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Item.objects.filter(id__in=[desktop.id, psu.id]).exists())
+        self.assertFalse(Note.objects.filter(item_id=psu.id).exists())
+
+        self.workbench.refresh_from_db()
+        self.laptop.refresh_from_db()
+        self.assertEqual(self.workbench.get_descendant_count(), self.workbench.get_descendants().count())
+        self.assertTrue(self.laptop in self.workbench.get_descendants())
+
     def test_validation(self):
         """Test data validation and business rules"""
         # Test circular reference prevention
@@ -219,10 +375,27 @@ class InventorySystemTests(TestCase):
         
         response = self.client.put(
             f"/api/items/{parent.id}/move",
-            json={"new_parent_id": child.id}
+            {"new_parent_id": child.id},
+            content_type="application/json"
         )
         self.assertEqual(response.status_code, 400)
 
+        # Test self-move rejection, and 404 before it for a missing item
+        response = self.client.put(
+            f"/api/items/{parent.id}/move",
+            {"new_parent_id": parent.id},
+            content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['detail'], "['Cannot move item under itself']")
+
+        response = self.client.put(
+            "/api/items/999999/move",
+            {"new_parent_id": 999999},
+            content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 404)
+
     def tearDown(self):
         """Clean up after each test"""
         File.objects.all().delete()